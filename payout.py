@@ -1,58 +1,130 @@
+import threading
+
 import streamlit as st
 import pandas as pd
+import numpy as np
 import altair as alt
+from scipy.signal import lfilter
 
 # ---------------------------- Core simulation logic ---------------------------- #
 
 import yfinance as yf
 
-ticker = yf.Ticker("HAPBF")
+def _fetch_hapbf_price(box: dict) -> None:
+    try:
+        # --- 1) preferred: fast_info (fastest, hits Yahoo real-time endpoint) ----
+        box["p"] = yf.Ticker("HAPBF").fast_info["last_price"]
+    except Exception as exc:                  # re-raised on the script thread
+        box["err"] = exc
+
+@st.cache_resource(ttl=300, show_spinner=False)   # one Yahoo round-trip per 5 min, not per rerun
+def start_hapbf_price_fetch() -> dict:
+    """Kick off the HAPBF price lookup on a daemon thread and return its result box."""
+    box: dict = {}
+    box["thread"] = threading.Thread(target=_fetch_hapbf_price, args=(box,), daemon=True)
+    box["thread"].start()
+    return box
+
+PRICE_FETCH_TIMEOUT_S = 15
+
+def get_hapbf_price(box: dict) -> float:
+    """Block until the background lookup lands and return the last trade price."""
+    box["thread"].join(timeout=PRICE_FETCH_TIMEOUT_S)
+    if box["thread"].is_alive():              # hung request – don't pin it for 5 min
+        start_hapbf_price_fetch.clear()
+        st.error(f"❌ Yahoo Finance did not answer within {PRICE_FETCH_TIMEOUT_S} s – "
+                 "use 'Refresh price' to try again")
+        st.stop()
+    if "err" in box:
+        start_hapbf_price_fetch.clear()       # shared cache – don't replay a failure to every session
+        raise box["err"]
+    return box["p"]
 
-# --- 1) preferred: fast_info (fastest, hits Yahoo real-time endpoint) ----
-price = ticker.fast_info["last_price"]      # float
-print("fast_info price:", price)
+_price_box = start_hapbf_price_fetch()      # non-blocking – UI paints while Yahoo answers
 
 MARKET_CAP_USD = 20.49 * 1_000_000   # 16.86 million USD
-SHARES_OUT     = MARKET_CAP_USD//price         # ≈ shares derived earlier (const)
-stock_price = price
-def simulate(acquisitions: dict[int, int], price_monthly: float, device_revenue: float,
-             valuation_multiple: float, vesting_dict: dict[int, float],retain_rate: float = 0.90,) -> pd.DataFrame:
-    """Return a DataFrame with revenue, value-add, and vested equity for each year."""
-    df = (
-        pd.DataFrame({
-            "Year": acquisitions.keys(),
-            "new_users": acquisitions.values(),
-        })
-        .set_index("Year")
-        .sort_index()
-    )
-
-    df["one_time_rev"] = df["new_users"] * device_revenue
+# Fixed display setup – scenario names and table formats defined once, in one place.
+# Fixed display setup – built once here rather than inside the rerun body.
+SCEN_NAMES = ("Conservative", "Base", "Aggressive")
+# Formatting happens client-side in the Arrow grid instead of via pandas Styler HTML.
+# "dollar" renders with cents ($1,234.00) – intended: printf formats ("$%.0f") have
+# no thousands separator in the grid. "percent" trims trailing zeros (0.5 → 50%).
+_MONEY = st.column_config.NumberColumn(format="dollar")
+RESULT_COLUMN_CONFIG = {
+    "one_time_rev": _MONEY,
+    "arr": _MONEY,
+    "value_added": _MONEY,
+    "vested_pct": st.column_config.NumberColumn(format="percent"),
+    "equity_value": _MONEY,
+}
+_SHARE_PRICE = st.column_config.NumberColumn(format="$%.3f")
+SHARE_PRICE_COLUMN_CONFIG = {name: _SHARE_PRICE for name in SCEN_NAMES}
+
+def _simulate_batch(acqs: dict[str, dict[int, int]], years: tuple[int, ...], annual_price: float,
+                    device_revenue: float, valuation_multiple: float, vesting_dict: dict[int, float],
+                    retain_rate: float, shares_out: float,) -> dict[str, pd.DataFrame]:
+    """Run scenarios that share the same `years` as rows of one (scenarios × years) matrix."""
+    users = np.array([[acq[y] for y in years] for acq in acqs.values()],
+                     dtype=np.int64).reshape(len(acqs), len(years))
+
+    nu = users.astype(np.float64)
+    otr = nu * device_revenue
         # --- NEW: cumulative active users with 90 % retention ---------------- #
     # RETAIN = 0.90                     # 90 % of last year’s users stay active
-    active = 0                        # running total of still-paying users
-    cum_list = []                     # to collect year-by-year results
-
-    for y in df.index:                # iterate in chronological order
-        active = df.at[y, "new_users"] + active * retain_rate
-        print('active:',active)
-        cum_list.append(active)
-    print(cum_list)
-
-    df["cum_users"] = cum_list        # replaces simple .cumsum()
+    # active[i] = new[i] + r·active[i-1] is a first-order IIR filter → run it in C
+    cum = lfilter([1.0], [1.0, -retain_rate], nu, axis=1)   # replaces simple .cumsum()
     # -------------------------------------------------------------------- #
 
-    df["arr"] = df["cum_users"] * price_monthly * 12
-    # df["arr"] = df["new_users"] * price_monthly * 12
-    df["value_added"] = df["arr"] * valuation_multiple + df["one_time_rev"]
-    df["vested_pct"] = df.index.to_series().map(vesting_dict).fillna(0)
-    df["equity_value"] = df["value_added"] * df["vested_pct"]
+    arr = cum * annual_price
+    va = arr * valuation_multiple + otr
+    vested = np.fromiter((vesting_dict.get(y, 0.0) for y in years),
+                         dtype=np.float64, count=len(years))
+    eq = va * vested
         # --- NEW: translate value-added into market-cap & share-price -----------
-    df["cum_val_added"] = df["value_added"].cumsum()
-    df["market_cap_usd"]   = MARKET_CAP_USD + df["cum_val_added"]
-    df["share_price_usd"]  = df["market_cap_usd"] / SHARES_OUT
-    print(df)
-    return df
+    cva = np.cumsum(va, axis=1)
+    mcap = MARKET_CAP_USD + cva
+    sp = mcap / shares_out
+
+    # split back into one frame per scenario, for display only; Arrow-backed
+    # columns hand straight to st.dataframe's Arrow grid without conversion
+    index = pd.Index(years, name="Year")
+    frames = {}
+    for i, name in enumerate(acqs):
+        df = pd.DataFrame({
+            "one_time_rev": otr[i],
+            "cum_users": cum[i],
+            "arr": arr[i],
+            "value_added": va[i],
+            "vested_pct": vested,
+            "equity_value": eq[i],
+            "cum_val_added": cva[i],
+            "market_cap_usd": mcap[i],
+            "share_price_usd": sp[i],
+        }, index=index, dtype="float64[pyarrow]")
+        df.insert(0, "new_users", pd.array(users[i], dtype="int64[pyarrow]"))
+        frames[name] = df
+    return frames
+
+@st.cache_data(show_spinner=False)   # pure function of its args → memoised across reruns
+def simulate(scenarios: dict[str, tuple[tuple[int, int], ...]], annual_price: float, device_revenue: float,
+             valuation_multiple: float, vesting_dict: dict[int, float],retain_rate: float,
+             shares_out: float,) -> dict[str, pd.DataFrame]:
+    """Return {scenario: DataFrame} with revenue, value-add, and vested equity for each year.
+
+    Scenarios with identical year sets run together in one batch; a scenario
+    with its own years is batched alone, so each frame covers only the years
+    entered for it and never depends on another scenario's input.
+    """
+    groups: dict[tuple[int, ...], dict[str, dict[int, int]]] = {}
+    for name, pairs in scenarios.items():
+        acq = dict(pairs)
+        groups.setdefault(tuple(sorted(acq)), {})[name] = acq
+
+    frames = {}
+    for years, acqs in groups.items():
+        frames.update(_simulate_batch(acqs, years, annual_price, device_revenue,
+                                      valuation_multiple, vesting_dict, retain_rate, shares_out))
+    return {name: frames[name] for name in scenarios}        # keep caller's order
 
 # ---------------------------- UI layout --------------------------------------- #
 
@@ -79,7 +151,11 @@ with st.sidebar:
         "Device revenue (one-time $)", min_value=0.0, value=200.0, step=10.0
     )
     st.markdown("#### Current HAPBF price (Yahoo Finance)")
-    st.metric("Last trade", f"${price:.4f}")      # shows, e.g., $0.0811
+    price_slot = st.empty()                       # filled once the fetch lands
+    price_slot.caption("Fetching latest trade…")
+    if st.button("Refresh price"):
+        start_hapbf_price_fetch.clear()           # bust the 5-min cache
+        st.rerun()
 
     # st.markdown("### Company stock price ($)")
 
@@ -172,12 +248,14 @@ with st.sidebar:
     aggr_txt = st.text_area("Aggressive", "1:100000,2:150000,3:200000")
 
 # Helper to parse acquisitions safely
-def parse_pairs(s: str) -> dict[int, int]:
+@st.cache_data(show_spinner=False)   # keyed on the raw text-area string
+def parse_pairs(s: str) -> tuple[tuple[int, int], ...]:
+    """Parse "1:1200,2:3000" into ((1, 1200), (2, 3000)) – immutable, so it hashes cheaply."""
     try:
-        return {
-            int(item.split(":")[0].strip()): int(item.split(":")[1].strip())
-            for item in s.split(",") if ":" in item
-        }
+        return tuple(
+            (int(year.strip()), int(users.strip()))
+            for year, users, *_ in (item.split(":") for item in s.split(",") if ":" in item)
+        )
     except Exception:
         st.error("❌ Invalid format – use year:users pairs like 1:1200,2:3000")
         st.stop()
@@ -186,106 +264,141 @@ acq_base = parse_pairs(base_txt)
 acq_cons = parse_pairs(cons_txt)
 acq_aggr = parse_pairs(aggr_txt)
 
-# Run simulations
-results = {
-    "Conservative": simulate(acq_cons, price_monthly, device_revenue,
-                             valuation_multiple, vesting, retain_rate,
-                             ),
-    "Base":         simulate(acq_base, price_monthly, device_revenue,
-                             valuation_multiple, vesting, retain_rate,
-                             ),
-    "Aggressive":   simulate(acq_aggr, price_monthly, device_revenue,
-                             valuation_multiple, vesting, retain_rate,
-                             )
-}
-proj_price_long = (
-    pd.concat({name: df["share_price_usd"]
-               for name, df in results.items()}, axis=1)      # stack side-by-side
-      .reset_index()                                          # make Year a column
-      .melt(id_vars="Year", var_name="Scenario",
-            value_name="share_price_usd")                     # long form
-)
+price = get_hapbf_price(_price_box)          # float
+price_slot.metric("Last trade", f"${price:.4f}")   # shows, e.g., $0.0811
+SHARES_OUT     = MARKET_CAP_USD / price        # ≈ shares derived earlier (const)
+stock_price = price
+
+ANNUAL_PRICE = price_monthly * 12.0        # subscription revenue per active user per year
+
+# Run simulations (one batched pass over all three scenarios) – only when a
+# model input changed; cosmetic widgets like the share-label toggle reuse the
+# previous results straight from session state.
+fp = (ANNUAL_PRICE, device_revenue, valuation_multiple, retain_rate,
+      tuple(vesting.items()), acq_cons, acq_base, acq_aggr, SHARES_OUT)
+if st.session_state.get("fp") != fp:
+    st.session_state["results"] = simulate(
+        dict(zip(SCEN_NAMES, (acq_cons, acq_base, acq_aggr))),
+        ANNUAL_PRICE, device_revenue, valuation_multiple, vesting, retain_rate,
+        SHARES_OUT,
+    )
+    st.session_state["fp"] = fp
+results = st.session_state["results"]
+if st.query_params.get("debug"):             # ?debug=1 – opt-in replacement for the old print(df)
+    st.write("fast_info price:", price)
+    for name, df in results.items():
+        st.write(name, df)
+
+def _long_frame(results: dict[str, pd.DataFrame], **columns: str) -> pd.DataFrame:
+    """Stack results into long form (Year, Scenario, *columns) in one allocation.
+
+    Scenarios may cover different years, so each contributes its own Year
+    index and the scenario name is repeated once per row it owns.
+    """
+    names = list(results)
+    return pd.DataFrame({
+        "Year": np.concatenate([results[k].index.to_numpy() for k in names]),
+        "Scenario": np.repeat(names, [len(results[k]) for k in names]),
+        **{out: np.concatenate([results[k][col].to_numpy() for k in names])
+           for out, col in columns.items()},
+    })
+
+# Chart frames depend only on `results`; cache the reshapes so UI-only
+# interactions (e.g. the share-label toggle) skip the pandas work.
+@st.cache_data(show_spinner=False)
+def build_combined_equity(results: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    combined_equity = _long_frame(results, Equity="equity_value",
+                                  share_price_usd="share_price_usd")
+    combined_equity["Shares"] = (
+        combined_equity["Equity"] / combined_equity["share_price_usd"]
+    )
+    combined_equity["SharesLabel"] = [                         # "[123,456]"
+        f"[{v:,.0f}]" for v in combined_equity["Shares"].to_numpy()
+    ]
+    return combined_equity
+
+@st.cache_data(show_spinner=False)
+def build_combined_va(results: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    return _long_frame(results, ValueAdded="value_added")
+
 # ---------------------------- Display ----------------------------------------- #
 
 # 1️⃣  Combined EQUITY line chart with labels
 # combined_equity = pd.concat({k: v["equity_value"] for k, v in results.items()}, axis=1).reset_index().melt(id_vars="Year", var_name="Scenario", value_name="Equity")
-combined_equity = (
-    pd.concat({k: v["equity_value"] for k, v in results.items()}, axis=1)
-      .reset_index()
-      .melt(id_vars="Year", var_name="Scenario", value_name="Equity")
-      .merge(proj_price_long, on=["Year", "Scenario"])            # ← NEW merge
-)
-combined_equity["Shares"] = (
-    combined_equity["Equity"] / combined_equity["share_price_usd"]
-)
-combined_equity["SharesLabel"] = combined_equity["Shares"].apply(
-    lambda s: f"[{s:,.0f}]"
-)
+combined_equity = build_combined_equity(results)
 
 # # --- shares = equity / stock_price -------------------------------------- #
 # combined_equity["Shares"] = combined_equity["Equity"] / stock_price           # numeric
 # combined_equity["SharesLabel"] = combined_equity["Shares"].apply(             # "[123,456]"
 #     lambda s: f"[{s:,.0f}]"
 # )
-line_equity = alt.Chart(combined_equity).mark_line(point=True).encode(
-    x=alt.X("Year:O", axis=alt.Axis(title="Year", tickMinStep=1,labelAngle=0)),
-    y=alt.Y("Equity:Q", axis=alt.Axis(title="Equity Value ($)", format="$,.0f")),
-    color="Scenario:N",
-    tooltip=["Scenario", "Year", alt.Tooltip("Equity", format="$,.0f")],
-)
-labels_equity = line_equity.mark_text(dy=-15, fontWeight="bold").encode(
-    text=alt.Text("Equity:Q", format="$,.0f")
-)
-shares_labels = (
-    alt.Chart(combined_equity)
-    .mark_text(dy=15, fontWeight="bold")                                       # 15 px below the point
-    .encode(
-        x="Year:O",
-        y="Equity:Q",
+# Altair spec building is pure-Python JSON construction; compile each chart's
+# data-less Vega-Lite spec once and pass the frame alongside it, so Streamlit
+# ships the data straight to Arrow.
+def _vega_spec(chart: alt.TopLevelMixin) -> dict:
+    spec = chart.properties(width=800, height=350).to_dict()
+    spec.pop("config", None)          # drop Altair's 300×300 view theme; Streamlit styles the chart
+    # Altair points data-less layers at a placeholder "empty" dataset; strip it
+    # so every layer inherits the frame passed to st.vega_lite_chart
+    spec.pop("datasets", None)
+    for layer in spec.get("layer", []):
+        layer.pop("data", None)
+    return spec
+
+@st.cache_data(show_spinner=False)
+def equity_spec(show_shares: bool) -> dict:
+    line_equity = alt.Chart().mark_line(point=True).encode(
+        x=alt.X("Year:O", axis=alt.Axis(title="Year", tickMinStep=1,labelAngle=0)),
+        y=alt.Y("Equity:Q", axis=alt.Axis(title="Equity Value ($)", format="$,.0f")),
         color="Scenario:N",
-        text="SharesLabel:N",
+        tooltip=["Scenario:N", "Year:O", alt.Tooltip("Equity:Q", format="$,.0f")],
+    )
+    labels_equity = line_equity.mark_text(dy=-15, fontWeight="bold").encode(
+        text=alt.Text("Equity:Q", format="$,.0f")
+    )
+    shares_labels = (
+        alt.Chart()
+        .mark_text(dy=15, fontWeight="bold")                                       # 15 px below the point
+        .encode(
+            x="Year:O",
+            y="Equity:Q",
+            color="Scenario:N",
+            text="SharesLabel:N",
+        )
     )
-)
 
-base_layers = line_equity + labels_equity          # always visible
-if show_shares:                                    # add only if switch ON
-    equity_chart = base_layers + shares_labels
-else:
-    equity_chart = base_layers
+    base_layers = line_equity + labels_equity          # always visible
+    if show_shares:                                    # add only if switch ON
+        equity_chart = base_layers + shares_labels
+    else:
+        equity_chart = base_layers
+    return _vega_spec(equity_chart)
+
+@st.cache_data(show_spinner=False)
+def va_spec() -> dict:
+    line_va = alt.Chart().mark_line(point=True).encode(
+        x=alt.X("Year:O", axis=alt.Axis(title="Year", tickMinStep=1,labelAngle=0)),
+        y=alt.Y("ValueAdded:Q", axis=alt.Axis(title="Valuation Added ($)", format="$,.0f")),
+        color="Scenario:N",
+        tooltip=["Scenario:N", "Year:O", alt.Tooltip("ValueAdded:Q", format="$,.0f")],
+    )
+    labels_va = line_va.mark_text(dy=-15, fontWeight="bold").encode(
+        text=alt.Text("ValueAdded:Q", format="$,.0f")
+    )
+    return _vega_spec(line_va + labels_va)
 
 st.header("📈 Equity Value Comparison Across Scenarios")
-st.altair_chart(
-    equity_chart.properties(width=800, height=350),
-    use_container_width=True,
-)
+st.vega_lite_chart(combined_equity, equity_spec(show_shares), use_container_width=True)
 # 2️⃣ Combined VALUE‑ADDED line chart with labels
-combined_va = pd.concat({k: v["value_added"] for k, v in results.items()}, axis=1).reset_index().melt(id_vars="Year", var_name="Scenario", value_name="ValueAdded")
-
-line_va = alt.Chart(combined_va).mark_line(point=True).encode(
-    x=alt.X("Year:O", axis=alt.Axis(title="Year", tickMinStep=1,labelAngle=0)),
-    y=alt.Y("ValueAdded:Q", axis=alt.Axis(title="Valuation Added ($)", format="$,.0f")),
-    color="Scenario:N",
-    tooltip=["Scenario", "Year", alt.Tooltip("ValueAdded", format="$,.0f")],
-)
-labels_va = line_va.mark_text(dy=-15, fontWeight="bold").encode(
-    text=alt.Text("ValueAdded:Q", format="$,.0f")
-)
+combined_va = build_combined_va(results)
 
 st.header("🏷️ Valuation Added Across Scenarios")
-st.altair_chart((line_va + labels_va).properties(width=800, height=350), use_container_width=True)
+st.vega_lite_chart(combined_va, va_spec(), use_container_width=True)
 
 # 3️⃣  Scenario tables
-fmt = {
-    "one_time_rev": "${:,.0f}",
-    "arr": "${:,.0f}",
-    "value_added": "${:,.0f}",
-    "vested_pct": "{:.0%}",
-    "equity_value": "${:,.0f}",
-}
-
-for name in ["Conservative", "Base", "Aggressive"]:
+for name in SCEN_NAMES:
     st.subheader(f"🧮 {name} scenario – yearly results")
-    st.dataframe(results[name].style.format(fmt))
+    st.dataframe(results[name], column_config=RESULT_COLUMN_CONFIG)
 
 
 proj_price_df = pd.concat(
@@ -293,6 +406,4 @@ proj_price_df = pd.concat(
     axis=1
 ).reset_index().rename_axis(None, axis=1)
 st.subheader("💵 Projected Share Price (USD)")
-st.dataframe(proj_price_df.style.format({"Conservative":"${:,.3f}",
-                                   "Base":"${:,.3f}",
-                                   "Aggressive":"${:,.3f}"}))
\ No newline at end of file
+st.dataframe(proj_price_df, column_config=SHARE_PRICE_COLUMN_CONFIG)